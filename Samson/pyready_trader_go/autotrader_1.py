@@ -16,17 +16,21 @@
 #     License along with Ready Trader Go.  If not, see
 #     <https://www.gnu.org/licenses/>.
 import asyncio
-import itertools
+import collections
+import logging
 import time
 import math
 
-from typing import List
+from typing import Deque, List, Optional, Tuple
 
 from ready_trader_go import BaseAutoTrader, Instrument, Lifespan, MAXIMUM_ASK, MINIMUM_BID, Side
+from ready_trader_go.messages import HEADER
 
 
 LOT_SIZE = 30
 POSITION_LIMIT = 100
+# Number of recent order ids remembered per side, enough to cover in-flight cancels
+RECENT_ORDER_IDS = 16
 TICK_SIZE_IN_CENTS = 100
 MIN_BID_NEAREST_TICK = (MINIMUM_BID + TICK_SIZE_IN_CENTS) // TICK_SIZE_IN_CENTS * TICK_SIZE_IN_CENTS
 MAX_ASK_NEAREST_TICK = MAXIMUM_ASK // TICK_SIZE_IN_CENTS * TICK_SIZE_IN_CENTS
@@ -37,11 +41,50 @@ IMBAL_THRESHOLD = 0.5
 K1 = 4
 K2 = 8
 INV_SCALAR = -0.05
+# Half spreads in cents
+_HALF_K1_TICKS = (K1 * TICK_SIZE_IN_CENTS) // 2
+_HALF_K2_TICKS = (K2 * TICK_SIZE_IN_CENTS) // 2
+# Quote volume on the side that would add to a position of each size
+_VOL_BY_POS = tuple(math.floor(LOT_SIZE * math.exp(INV_SCALAR * p)) for p in range(POSITION_LIMIT + 1))
+# Exponential decay weights for each order book level
+_DECAY_WEIGHTS = tuple(math.exp(-0.5*i) for i in range(16))
 
-def roundup(x):
-    return int(math.ceil(x / 100.)) * 100
-def rounddown(x):
-    return int(math.floor(x / 100.)) * 100
+def roundup(x: float) -> int:
+    return -int(-x // 100) * 100
+def rounddown(x: float) -> int:
+    return int(x // 100) * 100
+
+def compute_theo(bid_volumes: List[int], ask_volumes: List[int], bid_p0: int, ask_p0: int,
+                 position: int) -> Tuple[float, float, int, int, int, int]:
+    """Return the theoretical price, imbalance and the new quote prices and volumes.
+
+    This is a pure function of its arguments with no access to trader state,
+    so it can be compiled ahead of time (e.g. by Cython in pure Python mode)
+    without changing the caller.
+    """
+    V_bid = V_ask = 0.0
+    for w, bid_volume, ask_volume in zip(_DECAY_WEIGHTS, bid_volumes, ask_volumes):
+        V_bid += w * bid_volume
+        V_ask += w * ask_volume
+    imbal = (V_bid - V_ask) / (V_bid + V_ask) if (V_bid + V_ask) != 0 else 0
+    I = V_bid/(V_bid + V_ask) if (V_bid + V_ask) != 0 else 0
+    theo_F = I * ask_p0 + (1-I) * bid_p0
+    if imbal > IMBAL_THRESHOLD:
+        new_ask_price = roundup(theo_F + _HALF_K2_TICKS)
+        new_bid_price = rounddown(theo_F)
+    elif imbal < -IMBAL_THRESHOLD:
+        new_ask_price = roundup(theo_F)
+        new_bid_price = rounddown(theo_F - _HALF_K2_TICKS)
+    else:
+        new_ask_price = roundup(theo_F + _HALF_K1_TICKS)
+        new_bid_price = rounddown(theo_F - _HALF_K1_TICKS)
+    if position >= 0:
+        new_bid_volume = _VOL_BY_POS[min(position, POSITION_LIMIT)]
+        new_ask_volume = LOT_SIZE
+    else:
+        new_ask_volume = _VOL_BY_POS[min(-position, POSITION_LIMIT)]
+        new_bid_volume = LOT_SIZE
+    return theo_F, imbal, new_bid_price, new_ask_price, new_bid_volume, new_ask_volume
 
 class AutoTrader(BaseAutoTrader):
     """Example Auto-trader.
@@ -53,17 +96,29 @@ class AutoTrader(BaseAutoTrader):
     more lots than it has bought) then it increases its bid and ask prices.
     """
 
+    # Fixed attribute layout for the state read on every order book update
+    __slots__ = ("_next_id", "_recent_bid_ids", "_recent_ask_ids", "ask_id", "ask_price", "bid_id", "bid_price",
+                 "position", "position_cost", "bid_volume", "ask_volume", "bid_filled", "ask_filled", "time", "bid_qtime", "ask_qtime",
+                 "bid_etime", "ask_etime", "_last_quote", "_message_batch", "_quote_deadline", "_state_handlers",
+                 "theo_F", "logger")
+
     def __init__(self, loop: asyncio.AbstractEventLoop, team_name: str, secret: str):
         """Initialise a new instance of the AutoTrader class."""
         super().__init__(loop, team_name, secret)
-        self.order_ids = itertools.count(1)
-        self.bids = set()
-        self.asks = set()
+        self._next_id = 0
+        self._recent_bid_ids: Deque[int] = collections.deque(maxlen=RECENT_ORDER_IDS)
+        self._recent_ask_ids: Deque[int] = collections.deque(maxlen=RECENT_ORDER_IDS)
         self.ask_id = self.ask_price = self.bid_id = self.bid_price = self.position = self.position_cost = 0
-        self.time = self.bid_qtime = self.ask_qtime = self.bid_etime = self.ask_etime = time.time()
-        self.last_bid = []
-        self.last_ask = []
-        self.theo_F = self.theo_E = 0
+        self.bid_volume = self.ask_volume = 0
+        self.bid_filled = self.ask_filled = 0  # lots traded so far by the live order on each side
+        self.time = self.bid_qtime = self.ask_qtime = self.bid_etime = self.ask_etime = time.monotonic()
+        self._last_quote: Tuple[int, int, int, int] = (0, 0, 0, 0)
+        self._message_batch: Optional[List[bytes]] = None
+        self._quote_deadline: float = 0
+        # Order state handlers indexed by (bid_id != 0) | (ask_id != 0) << 1
+        self._state_handlers = (self._quote_no_orders, self._quote_bid_only, self._quote_ask_only,
+                                self._quote_both_orders)
+        self.theo_F: float = 0
 
     def on_error_message(self, client_order_id: int, error_message: bytes) -> None:
         """Called when the exchange detects an error.
@@ -71,8 +126,9 @@ class AutoTrader(BaseAutoTrader):
         If the error pertains to a particular order, then the client_order_id
         will identify that order, otherwise the client_order_id will be zero.
         """
-        self.logger.warning("error with order %d: %s", client_order_id, error_message.decode())
-        if client_order_id != 0 and (client_order_id in self.bids or client_order_id in self.asks):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.logger.warning("error with order %d: %s", client_order_id, error_message.decode())
+        if client_order_id != 0 and (client_order_id in self._recent_bid_ids or client_order_id in self._recent_ask_ids):
             self.on_order_status_message(client_order_id, 0, 0, 0)
 
     def on_hedge_filled_message(self, client_order_id: int, price: int, volume: int) -> None:
@@ -94,299 +150,169 @@ class AutoTrader(BaseAutoTrader):
         prices are reported along with the volume available at each of those
         price levels.
         """
-        self.logger.info("received order book for instrument %d with sequence number %d", instrument,
-                         sequence_number)
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("received order book for instrument %d with sequence number %d", instrument,
+                             sequence_number)
         # self.orderbook.append([instrument,sequence_number,ask_prices,ask_volumes,bid_prices,bid_volumes])
         # Futures Market
         if instrument == Instrument.FUTURE:
-            V_bid = 0
-            V_ask = 0
-            for i in range(min(len(bid_volumes), len(ask_volumes))):
-                V_bid += math.exp(-0.5*i) * bid_volumes[i]
-                V_ask += math.exp(-0.5*i) * ask_volumes[i]
-            imbal = (V_bid - V_ask) / (V_bid + V_ask) if (V_bid + V_ask) != 0 else 0
-            I = V_bid/(V_bid + V_ask) if (V_bid + V_ask) != 0 else 0
-            theo_F = I * ask_prices[0] + (1-I) * bid_prices[0]
-            self.logger.info("Imbalance: %.2f, Theo: %d", imbal, theo_F)
+            now = time.monotonic()
+            theo_F, imbal, new_bid_price, new_ask_price, new_bid_volume, new_ask_volume = compute_theo(
+                bid_volumes, ask_volumes, bid_prices[0], ask_prices[0], self.position)
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Imbalance: %.2f, Theo: %d", imbal, theo_F)
             if theo_F != 0:
-                if imbal > IMBAL_THRESHOLD:
-                    new_ask_price = roundup(theo_F + K2/2 * TICK_SIZE_IN_CENTS)
-                    new_bid_price = rounddown(theo_F)
-                elif imbal < -IMBAL_THRESHOLD:
-                    new_ask_price = roundup(theo_F)
-                    new_bid_price = rounddown(theo_F - K2/2 * TICK_SIZE_IN_CENTS)
-                else:
-                    new_ask_price = roundup(theo_F + K1/2 * TICK_SIZE_IN_CENTS)
-                    new_bid_price = rounddown(theo_F - K1/2 * TICK_SIZE_IN_CENTS)
-                if self.position >= 0:
-                    new_bid_volume = math.floor(LOT_SIZE * math.exp(INV_SCALAR * self.position))
-                    new_ask_volume = math.floor(LOT_SIZE)
-                if self.position < 0:
-                    new_ask_volume = math.floor(LOT_SIZE * math.exp(-INV_SCALAR * self.position))
-                    new_bid_volume = math.floor(LOT_SIZE)
                 self.theo_F = theo_F
-                # Orders
-                # If no orders in book
-                if self.bid_id == 0 and self.ask_id == 0:
-                    # Check if new_price is not same as current price
-                    if new_bid_price not in (self.bid_price, 0):
-                        # Send orders
-                        self.bid_id = next(self.order_ids)
-                        self.bid_price = new_bid_price
-                        self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-                        self.logger.info("Order %d: Bid %d @ %d, Imbal: %.2f, Theo: %d", self.bid_id, new_bid_volume, new_bid_price, imbal, self.theo_F)
-                        self.bids.add(self.bid_id)
-                        self.bid_qtime = time.time()
-                        
-                    if new_ask_price not in (self.ask_price, 0):
-                        self.ask_id = next(self.order_ids)
-                        self.ask_price = new_ask_price
-                        self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-                        self.logger.info("Order %d: Ask %d @ %d, Imbal: %.2f, Theo: %d", self.ask_id, new_ask_volume, new_ask_price, imbal, self.theo_F)
-                        self.asks.add(self.ask_id)
-                        self.ask_qtime = time.time()
-                
-                # Else if only 1 order
-                elif self.bid_id == 0 and self.ask_id != 0:
-                    # If didn't wait long enough:
-                    if (time.time() - self.bid_etime) > WAIT_TIME:
-                        self.send_cancel_order(self.ask_id)
-                        self.logger.info("Ask %d Canceled", self.ask_id)
-                        self.ask_id = 0
-                        # Check if new_price is not same as current price and position limit
-                        if new_bid_price not in (self.bid_price, 0):
-                            # Send orders
-                            self.bid_id = next(self.order_ids)
-                            self.bid_price = new_bid_price
-                            self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Bid %d @ %d, Imbal: %.2f, Theo: %d", self.bid_id, new_bid_volume, new_bid_price, imbal, self.theo_F)
-                            self.bids.add(self.bid_id)
-                            self.bid_qtime = time.time()
-                            
-                        if new_ask_price not in (self.ask_price, 0):
-                            self.ask_id = next(self.order_ids)
-                            self.ask_price = new_ask_price
-                            self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Ask %d @ %d, Imbal: %.2f, Theo: %d", self.ask_id, new_ask_volume, new_ask_price, imbal, self.theo_F)
-                            self.asks.add(self.ask_id)
-                            self.ask_qtime = time.time()
-                    # Else
-                    else:
-                        pass
-                    
-                elif self.bid_id != 0 and self.ask_id == 0:
-                    # If didn't wait long enough:
-                    if (time.time() - self.ask_etime) > WAIT_TIME:
-                        self.send_cancel_order(self.bid_id)
-                        self.logger.info("Bid %d Canceled", self.bid_id)
-                        self.bid_id = 0
-                        # Check if new_price is not same as current price and position limit
-                        if new_bid_price not in (self.bid_price, 0):
-                            # Send orders
-                            self.bid_id = next(self.order_ids)
-                            self.bid_price = new_bid_price
-                            self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Bid %d @ %d, Imbal: %.2f, Theo: %d", self.bid_id, new_bid_volume, new_bid_price, imbal, self.theo_F)
-                            self.bids.add(self.bid_id)
-                            self.bid_qtime = time.time()
-                            
-                        if new_ask_price not in (self.ask_price, 0):
-                            self.ask_id = next(self.order_ids)
-                            self.ask_price = new_ask_price
-                            self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Ask %d @ %d, Imbal: %.2f, Theo: %d", self.ask_id, new_ask_volume, new_ask_price, imbal, self.theo_F)
-                            self.asks.add(self.ask_id)
-                            self.ask_qtime = time.time()
-                    # Else pass
-                    else:
-                        pass
-                    
-                # If there are 2 orders
-                elif self.bid_id != 0 and self.ask_id != 0:
-                    # If over update threshold
-                    if (time.time() - self.ask_qtime) > UPDATE_TIME:
-                        # Cancel all orders
-                        self.send_cancel_order(self.bid_id)
-                        self.send_cancel_order(self.ask_id)
-                        self.logger.info("Both %d, %d Canceled", self.bid_id, self.ask_id)
-                        self.bid_id = 0
-                        self.ask_id = 0
-                        # Check if new_price is not same as current price and position limit
-                        if new_bid_price not in (self.bid_price, 0):
-                            # Send orders
-                            self.bid_id = next(self.order_ids)
-                            self.bid_price = new_bid_price
-                            self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Bid %d @ %d, Imbal: %.2f, Theo: %d", self.bid_id, new_bid_volume, new_bid_price, imbal, self.theo_F)
-                            self.bids.add(self.bid_id)
-                            self.bid_qtime = time.time()
-                            
-                        if new_ask_price not in (self.ask_price, 0):
-                            self.ask_id = next(self.order_ids)
-                            self.ask_price = new_ask_price
-                            self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Ask %d @ %d, Imbal: %.2f, Theo: %d", self.ask_id, new_ask_volume, new_ask_price, imbal, self.theo_F)
-                            self.asks.add(self.ask_id)
-                            self.ask_qtime = time.time()
-                    else:
-                        pass
-            
-        # # ETF Market
-        # elif instrument == Instrument.ETF:
-        #     # Position Check
-        #     if self.position > 0.95 * POSITION_LIMIT:
-        #         # Cancel all orders
-        #         self.send_cancel_order(self.bid_id)
-        #         self.bid_id = 0
-        #         self.send_cancel_order(self.ask_id)
-        #         self.ask_id = 0
-                
-        #         # Liquidate Inventory for Profit
-        #         self.ask_id = next(self.order_ids)
-        #         new_ask_price = self.last_ask
-        #         self.ask_price = new_ask_price
-        #         self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, math.floor(abs(self.position)/4), Lifespan.GOOD_FOR_DAY)
-        #         self.asks.add(self.ask_id)
-        #         self.ask_qtime = time.time()
-                
-        #     elif self.position < -0.95 * POSITION_LIMIT:
-        #         # Cancel all orders
-        #         self.send_cancel_order(self.bid_id)
-        #         self.bid_id = 0
-        #         self.send_cancel_order(self.ask_id)
-        #         self.ask_id = 0
-                
-        #         # Liquidate Inventory for Profit
-        #         self.bid_id = next(self.order_ids)
-        #         new_bid_price = self.last_bid
-        #         self.bid_price = new_bid_price
-        #         self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, math.floor(abs(self.position)/4), Lifespan.GOOD_FOR_DAY)
-        #         self.bids.add(self.bid_id)
-        #         self.bid_qtime = time.time()
-            
-        #     else:
-        #         self.last_ask = ask_prices[0]
-        #         self.last_bid = bid_prices[0]
-        #         V_bid = 0
-        #         V_ask = 0
-        #         for i in range(min(len(bid_volumes), len(ask_volumes))):
-        #             V_bid += math.exp(-0.5*i) * bid_volumes[i]
-        #             V_ask += math.exp(-0.5*i) * ask_volumes[i]
-        #         imbal = (V_bid - V_ask) / (V_bid + V_ask) if (V_bid + V_ask) != 0 else 0
-        #         I = V_bid/(V_bid + V_ask) if (V_bid + V_ask) != 0 else 0
-        #         theo_E = I * ask_prices[0] + (1-I) * bid_prices[0]
-        #         if theo_E != 0:
-        #             if imbal > 0.5:
-        #                 new_ask_price = roundup(theo_E + K2/2 * TICK_SIZE_IN_CENTS)
-        #                 new_bid_price = rounddown(theo_E)
-        #             elif imbal < 0.5:
-        #                 new_ask_price = roundup(theo_E)
-        #                 new_bid_price = rounddown(theo_E - K2/2 * TICK_SIZE_IN_CENTS)
-        #             else:
-        #                 new_ask_price = roundup(theo_E + K1/2 * TICK_SIZE_IN_CENTS)
-        #                 new_bid_price = rounddown(theo_E - K1/2 * TICK_SIZE_IN_CENTS)
-        #             if self.position >= 0:
-        #                 new_bid_volume = math.floor(LOT_SIZE * math.exp(INV_SCALAR * self.position))
-        #                 new_ask_volume = math.floor(LOT_SIZE)
-        #             if self.position < 0:
-        #                 new_ask_volume = math.floor(LOT_SIZE * math.exp(-INV_SCALAR * self.position))
-        #                 new_bid_volume = math.floor(LOT_SIZE)
-        #             print(theo_E)
-        #             # Orders
-        #             # If no orders in book
-        #             if self.bid_id == 0 and self.ask_id == 0:
-        #                 # Check if new_price is not same as current price
-        #                 if new_bid_price not in (self.bid_price, 0):
-        #                     # Send orders
-        #                     self.bid_id = next(self.order_ids)
-        #                     self.bid_price = new_bid_price
-        #                     self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-        #                     self.bids.add(self.bid_id)
-        #                     self.bid_qtime = time.time()
-                            
-        #                 if new_ask_price not in (self.ask_price, 0):
-        #                     self.ask_id = next(self.order_ids)
-        #                     self.ask_price = new_ask_price
-        #                     self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-        #                     self.asks.add(self.ask_id)
-        #                     self.ask_qtime = time.time()
-                    
-        #             # Else if only 1 order
-        #             elif self.bid_id == 0 and self.ask_id != 0:
-        #                 # If didn't wait long enough:
-        #                 if (time.time() - self.bid_etime) > WAIT_TIME:
-        #                     self.send_cancel_order(self.ask_id)
-        #                     self.ask_id = 0
-        #                     # Check if new_price is not same as current price and position limit
-        #                     if new_bid_price not in (self.bid_price, 0):
-        #                         # Send orders
-        #                         self.bid_id = next(self.order_ids)
-        #                         self.bid_price = new_bid_price
-        #                         self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-        #                         self.bids.add(self.bid_id)
-        #                         self.bid_qtime = time.time()
-                                
-        #                     if new_ask_price not in (self.ask_price, 0):
-        #                         self.ask_id = next(self.order_ids)
-        #                         self.ask_price = new_ask_price
-        #                         self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-        #                         self.asks.add(self.ask_id)
-        #                         self.ask_qtime = time.time()
-        #                 # Else
-        #                 else:
-        #                     pass
-                        
-        #             elif self.bid_id != 0 and self.ask_id == 0:
-        #                 # If didn't wait long enough:
-        #                 if (time.time() - self.ask_etime) > WAIT_TIME:
-        #                     self.send_cancel_order(self.bid_id)
-        #                     self.bid_id = 0
-        #                     # Check if new_price is not same as current price and position limit
-        #                     if new_bid_price not in (self.bid_price, 0):
-        #                         # Send orders
-        #                         self.bid_id = next(self.order_ids)
-        #                         self.bid_price = new_bid_price
-        #                         self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-        #                         self.bids.add(self.bid_id)
-        #                         self.bid_qtime = time.time()
-                                
-        #                     if new_ask_price not in (self.ask_price, 0):
-        #                         self.ask_id = next(self.order_ids)
-        #                         self.ask_price = new_ask_price
-        #                         self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-        #                         self.asks.add(self.ask_id)
-        #                         self.ask_qtime = time.time()
-        #                 # Else pass
-        #                 else:
-        #                     pass
-                        
-        #             # If there are 2 orders
-        #             elif self.bid_id != 0 and self.ask_id != 0:
-        #                 # If over update threshold
-        #                 if (time.time() - self.ask_qtime) > UPDATE_TIME:
-        #                     # Cancel all orders
-        #                     self.send_cancel_order(self.bid_id)
-        #                     self.bid_id = 0
-        #                     self.send_cancel_order(self.ask_id)
-        #                     self.ask_id = 0
-        #                     # Check if new_price is not same as current price and position limit
-        #                     if new_bid_price not in (self.bid_price, 0):
-        #                         # Send orders
-        #                         self.bid_id = next(self.order_ids)
-        #                         self.bid_price = new_bid_price
-        #                         self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-        #                         self.bids.add(self.bid_id)
-        #                         self.bid_qtime = time.time()
-                                
-        #                     if new_ask_price not in (self.ask_price, 0):
-        #                         self.ask_id = next(self.order_ids)
-        #                         self.ask_price = new_ask_price
-        #                         self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-        #                         self.asks.add(self.ask_id)
-        #                         self.ask_qtime = time.time()
-        #                 else:
-        #                     pass
-                    
+                # Nothing to do if the quote is unchanged and no order timer has run out since the last update
+                quote = (new_bid_price, new_ask_price, new_bid_volume, new_ask_volume)
+                if quote == self._last_quote and now <= self._quote_deadline:
+                    return
+                # Orders sent below are written to the exchange together, even if a handler raises
+                self._message_batch = []
+                try:
+                    state = (self.bid_id != 0) | ((self.ask_id != 0) << 1)
+                    self._state_handlers[state](now, new_bid_price, new_ask_price, new_bid_volume, new_ask_volume,
+                                                imbal)
+                finally:
+                    self._flush_messages()
+
+                # Remember the quote and when the order state above would next act on it
+                self._last_quote = quote
+                if self.bid_id != 0 and self.ask_id != 0:
+                    self._quote_deadline = self.ask_qtime + UPDATE_TIME
+                elif self.ask_id != 0:
+                    self._quote_deadline = self.bid_etime + WAIT_TIME
+                elif self.bid_id != 0:
+                    self._quote_deadline = self.ask_etime + WAIT_TIME
+                else:
+                    self._quote_deadline = math.inf
+
+    def _quote_no_orders(self, now: float, new_bid_price: int, new_ask_price: int, new_bid_volume: int,
+                         new_ask_volume: int, imbal: float) -> None:
+        """Place new quotes when there are no orders in the book."""
+        # Check if new_price is not same as current price
+        if new_bid_price not in (self.bid_price, 0):
+            self._place(Side.BUY, new_bid_price, new_bid_volume, imbal, now)
+        if new_ask_price not in (self.ask_price, 0):
+            self._place(Side.SELL, new_ask_price, new_ask_volume, imbal, now)
+
+    def _quote_ask_only(self, now: float, new_bid_price: int, new_ask_price: int, new_bid_volume: int,
+                        new_ask_volume: int, imbal: float) -> None:
+        """Requote once the bid has been gone for long enough, leaving only the ask."""
+        # If didn't wait long enough:
+        if (now - self.bid_etime) > WAIT_TIME:
+            self.send_cancel_order(self.ask_id)
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Ask %d Canceled", self.ask_id)
+            self.ask_id = 0
+            # Check if new_price is not same as current price and position limit
+            if new_bid_price not in (self.bid_price, 0):
+                self._place(Side.BUY, new_bid_price, new_bid_volume, imbal, now)
+            if new_ask_price not in (self.ask_price, 0):
+                self._place(Side.SELL, new_ask_price, new_ask_volume, imbal, now)
+
+    def _quote_bid_only(self, now: float, new_bid_price: int, new_ask_price: int, new_bid_volume: int,
+                        new_ask_volume: int, imbal: float) -> None:
+        """Requote once the ask has been gone for long enough, leaving only the bid."""
+        # If didn't wait long enough:
+        if (now - self.ask_etime) > WAIT_TIME:
+            self.send_cancel_order(self.bid_id)
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Bid %d Canceled", self.bid_id)
+            self.bid_id = 0
+            # Check if new_price is not same as current price and position limit
+            if new_bid_price not in (self.bid_price, 0):
+                self._place(Side.BUY, new_bid_price, new_bid_volume, imbal, now)
+            if new_ask_price not in (self.ask_price, 0):
+                self._place(Side.SELL, new_ask_price, new_ask_volume, imbal, now)
+
+    def _quote_both_orders(self, now: float, new_bid_price: int, new_ask_price: int, new_bid_volume: int,
+                           new_ask_volume: int, imbal: float) -> None:
+        """Refresh both orders once they are older than the update threshold."""
+        # If over update threshold
+        if (now - self.ask_qtime) > UPDATE_TIME:
+            # Refresh both orders, keeping any whose price has not moved. Every cancel goes out before
+            # any replacement is inserted so a new order never crosses our own stale one.
+            replace_bid = not self._amend_or_cancel(Side.BUY, new_bid_price, new_bid_volume, now)
+            replace_ask = not self._amend_or_cancel(Side.SELL, new_ask_price, new_ask_volume, now)
+            if replace_bid and new_bid_price != 0:
+                self._place(Side.BUY, new_bid_price, new_bid_volume, imbal, now)
+            if replace_ask and new_ask_price != 0:
+                self._place(Side.SELL, new_ask_price, new_ask_volume, imbal, now)
+
+    def send_message(self, typ: int, data: bytes, length: int) -> None:
+        """Send a message, or hold it back if a batch of orders is being built."""
+        if self._message_batch is None:
+            self._connection_transport.write(HEADER.pack(length, typ) + data)
+        else:
+            self._message_batch.append(HEADER.pack(length, typ) + data)
+
+    def _flush_messages(self) -> None:
+        """Write all held back messages to the exchange in a single call."""
+        batch = self._message_batch
+        self._message_batch = None
+        if batch:
+            self._connection_transport.write(b"".join(batch))
+
+    def _place(self, side: Side, price: int, volume: int, imbal: float, now: float) -> None:
+        """Insert a new good-for-day order and record it as the live quote on its side."""
+        self._next_id += 1
+        order_id = self._next_id
+        self.send_insert_order(order_id, side, price, volume, Lifespan.GOOD_FOR_DAY)
+        if side == Side.BUY:
+            self.bid_id = order_id
+            self.bid_price = price
+            self.bid_volume = volume
+            self.bid_filled = 0
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Order %d: Bid %d @ %d, Imbal: %.2f, Theo: %d", order_id, volume, price, imbal, self.theo_F)
+            self._recent_bid_ids.append(order_id)
+            self.bid_qtime = now
+        else:
+            self.ask_id = order_id
+            self.ask_price = price
+            self.ask_volume = volume
+            self.ask_filled = 0
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Order %d: Ask %d @ %d, Imbal: %.2f, Theo: %d", order_id, volume, price, imbal, self.theo_F)
+            self._recent_ask_ids.append(order_id)
+            self.ask_qtime = now
+
+    def _amend_or_cancel(self, side: Side, price: int, volume: int, now: float) -> bool:
+        """Amend the live order on the given side to a new volume, or cancel it.
+
+        The exchange only allows the volume of a resting order to be reduced,
+        and an amended volume counts lots already filled, so an order whose
+        price is unchanged is amended in place to the new volume plus its
+        fills and keeps its queue priority. Otherwise it is cancelled and
+        False is returned so the caller can insert its replacement.
+        """
+        if side == Side.BUY:
+            order_id, old_price, old_volume, filled = self.bid_id, self.bid_price, self.bid_volume, self.bid_filled
+        else:
+            order_id, old_price, old_volume, filled = self.ask_id, self.ask_price, self.ask_volume, self.ask_filled
+        total = volume + filled
+        if price == old_price and total <= old_volume:
+            if total != old_volume:
+                self.send_amend_order(order_id, total)
+                if self.logger.isEnabledFor(logging.INFO):
+                    self.logger.info("Order %d Amended to %d", order_id, total)
+            if side == Side.BUY:
+                self.bid_volume = total
+                self.bid_qtime = now
+            else:
+                self.ask_volume = total
+                self.ask_qtime = now
+            return True
+        self.send_cancel_order(order_id)
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("Order %d Canceled", order_id)
+        if side == Side.BUY:
+            self.bid_id = 0
+        else:
+            self.ask_id = 0
+        return False
+
     def on_order_filled_message(self, client_order_id: int, price: int, volume: int) -> None:
         """Called when one of your orders is filled, partially or fully.
 
@@ -397,13 +323,19 @@ class AutoTrader(BaseAutoTrader):
         self.logger.info("received order filled for order %d with price %d and volume %d", client_order_id,
                          price, volume)
         # Hedge
-        if client_order_id in self.bids:
+        if client_order_id == self.bid_id or client_order_id in self._recent_bid_ids:
+            if client_order_id == self.bid_id:
+                self.bid_filled += volume
             self.position += volume
-            self.send_hedge_order(next(self.order_ids), Side.ASK, MIN_BID_NEAREST_TICK, volume)
+            self._next_id += 1
+            self.send_hedge_order(self._next_id, Side.ASK, MIN_BID_NEAREST_TICK, volume)
             self.logger.info("Hedge: %d @ Market", -volume)
-        elif client_order_id in self.asks:
+        elif client_order_id == self.ask_id or client_order_id in self._recent_ask_ids:
+            if client_order_id == self.ask_id:
+                self.ask_filled += volume
             self.position -= volume
-            self.send_hedge_order(next(self.order_ids), Side.BID, MAX_ASK_NEAREST_TICK, volume)
+            self._next_id += 1
+            self.send_hedge_order(self._next_id, Side.BID, MAX_ASK_NEAREST_TICK, volume)
             self.logger.info("Hedge: %d @ Market", volume)
     
             
@@ -421,17 +353,16 @@ class AutoTrader(BaseAutoTrader):
         self.logger.info("received order status for order %d with fill volume %d remaining %d and fees %d",
                          client_order_id, fill_volume, remaining_volume, fees)
         if remaining_volume == 0:
+            # Order state has changed, so the next book update must be handled in full
+            self._last_quote = (0, 0, 0, 0)
             if client_order_id == self.bid_id:
                 self.bid_id = 0
-                self.bid_etime = time.time()
-                self.logger.info("Bid Execution Time: %.4f", self.bid_etime)
+                self.bid_etime = time.monotonic()
+                self.logger.info("Bid Execution Time: %.4f", self.bid_etime - self.bid_qtime)
             elif client_order_id == self.ask_id:
                 self.ask_id = 0
-                self.ask_etime = time.time()
-                self.logger.info("Ask Execution Time: %.4f", self.ask_etime)
-            # It could be either a bid or an ask
-            self.bids.discard(client_order_id)
-            self.asks.discard(client_order_id)
+                self.ask_etime = time.monotonic()
+                self.logger.info("Ask Execution Time: %.4f", self.ask_etime - self.ask_qtime)
 
     def on_trade_ticks_message(self, instrument: int, sequence_number: int, ask_prices: List[int],
                                ask_volumes: List[int], bid_prices: List[int], bid_volumes: List[int]) -> None:
@@ -16,12 +16,11 @@
 #     License along with Ready Trader Go.  If not, see
 #     <https://www.gnu.org/licenses/>.
 import asyncio
+import collections
 import itertools
+import logging
 import time
 import math
-import numpy as np
-import pandas as pd
-import scipy
 
 from typing import List
 
@@ -43,41 +42,83 @@ g = 0.001
 K = 2
 VOL1 = 50
 VOL2 = 100
+# Quote volume on the side that would add to a position of each size
+_VOL_BY_POS = tuple(round(LOT_SIZE * math.exp(INV_SCALAR * p)) for p in range(POSITION_LIMIT + 1))
+# Exponential decay weights for each order book level
+_W = tuple(math.exp(-0.5*i) for i in range(16))
+# (ask offset, bid offset, trade type) indexed by ETF volatility bucket, then by ask-heavy/balanced/bid-heavy book;
+# the side opposite the heavy side is quoted K2 from theo, the other K1/2
+_QUOTE_OFFSETS = tuple(((k * TICK_SIZE_IN_CENTS // 2, k * TICK_SIZE_IN_CENTS, "Ask Imbal"),
+                        (k * TICK_SIZE_IN_CENTS // 2, k * TICK_SIZE_IN_CENTS // 2, "Normal"),
+                        (k * TICK_SIZE_IN_CENTS, k * TICK_SIZE_IN_CENTS // 2, "Bid Imbal")) for k in (4, 6, 8))
 
-def roundup(x):
-    return int(math.ceil(x / 100.)) * 100
-
-def rounddown(x):
-    return int(math.floor(x / 100.)) * 100
+# Order log formats per trade type, built once instead of concatenated on every insert
+_FMT_BID = {tt: "Order %d: Bid %d @ %d, Imbal: %.2f, Theo: %d, Type: " + tt for tt in ("Normal", "Bid Imbal", "Ask Imbal")}
+_FMT_ASK = {tt: "Order %d: Ask %d @ %d, Imbal: %.2f, Theo: %d, Type: " + tt for tt in ("Normal", "Bid Imbal", "Ask Imbal")}
 
 def weighted_mid(bid_volumes, bid_prices, ask_volumes, ask_prices):
-    V_bid = 0
-    V_ask = 0
-    for i in range(min(len(bid_volumes), len(ask_volumes))):
-        V_bid += math.exp(-0.5*i) * bid_volumes[i]
-        V_ask += math.exp(-0.5*i) * ask_volumes[i]
-    I = V_bid/(V_bid + V_ask) if (V_bid + V_ask) != 0 else 0
+    V_bid = V_ask = 0.0
+    for w, bid_volume, ask_volume in zip(_W, bid_volumes, ask_volumes):
+        V_bid += w * bid_volume
+        V_ask += w * ask_volume
+    V_tot = V_bid + V_ask
+    if V_tot == 0:
+        return bid_prices[0], 0
+    I = V_bid / V_tot
     theo = I * ask_prices[0] + (1-I) * bid_prices[0]
-    return theo
+    return theo, (V_bid - V_ask) / V_tot
 
 def weighted_price(bid_volumes, bid_prices, ask_volumes, ask_prices):
-        P_w = 0
-        V_cum = 0
-        for i in range(min(len(bid_volumes), len(ask_volumes))):
-            # calculate wpr as the guide price
-            P_w += (bid_prices[i] * ask_volumes[i] + ask_prices[i] * bid_volumes[i])
-            V_cum += (ask_volumes[i] + bid_volumes[i])
-        wp = P_w / V_cum if V_cum != 0 else 0
-        return wp
-# get rid of the influence of the nan
-def ts_append(value, ts):
-    if value == 0 and ts:
-        ts.append(ts[-1])
-    if value != 0:
-        ts.append(value)
-    if not ts and value == 0:
-        ts.append(0)
-        
+    # calculate wpr as the guide price, pairing each side's prices with the opposite side's volumes
+    P_w = V_cum = 0
+    for bid_price, bid_volume, ask_price, ask_volume in zip(bid_prices, bid_volumes, ask_prices, ask_volumes):
+        P_w += bid_price * ask_volume + ask_price * bid_volume
+        V_cum += ask_volume + bid_volume
+    wp = P_w / V_cum if V_cum != 0 else 0
+    return wp
+
+
+
+class RollingVolatility:
+    """Rolling standard deviation of the last ROLLING_WNDW weighted prices.
+
+    A running sum and sum of squares, taken relative to the first price, are
+    updated as each price enters and leaves the window.
+    """
+
+    __slots__ = ("prices", "last", "ref", "s", "ss", "n", "vol")
+
+    def __init__(self):
+        self.prices = collections.deque(maxlen=ROLLING_WNDW)
+        self.last = self.ref = 0  # last non-zero weighted price and the first price seen
+        self.s = self.ss = 0.0
+        self.n = self.vol = 0
+
+    def update(self, wp: float) -> None:
+        """Add the latest weighted price and recompute the volatility once the window is full."""
+        self.n += 1
+        prices = self.prices
+        old = prices[0] if len(prices) == ROLLING_WNDW else None
+        # Carry the last non-zero price forward when a side of the book is empty
+        last = self.last = wp if wp != 0 else self.last
+        prices.append(last)
+        if self.n == 1:
+            self.ref = last
+        ref = self.ref
+        new = last - ref
+        s = self.s + new
+        ss = self.ss + new * new
+        if old is not None:
+            old -= ref
+            s -= old
+            ss -= old * old
+        self.s = s
+        self.ss = ss
+        if self.n > ROLLING_WNDW:
+            mean = s / ROLLING_WNDW
+            self.vol = math.sqrt(max(0.0, ss / ROLLING_WNDW - mean * mean))
+
+
 class AutoTrader(BaseAutoTrader):
     """Example Auto-trader.
 
@@ -88,12 +129,17 @@ class AutoTrader(BaseAutoTrader):
     more lots than it has bought) then it increases its bid and ask prices.
     """
 
+    __slots__ = ("order_ids", "order_side", "ask_id", "ask_price", "bid_id", "bid_price", "position", "position_cost",
+                 "time", "bid_qtime", "ask_qtime", "bid_etime", "ask_etime", "last_trade", "hedge_price", "trade_type",
+                 "theo_F", "theo_E", "bid_volume", "ask_volume", "EBid", "EAsk", "FBid", "FAsk", "BA_F", "BA_E",
+                 "mid_F", "mid_E", "stats_E", "stats_F", "signal", "imbal", "bid_ask_spreads",
+                 "diff_spread", "history", "cancel_signal_bid", "cancel_signal_ask", "_state_handlers", "logger")
+
     def __init__(self, loop: asyncio.AbstractEventLoop, team_name: str, secret: str):
         """Initialise a new instance of the AutoTrader class."""
         super().__init__(loop, team_name, secret)
         self.order_ids = itertools.count(1)
-        self.bids = set()
-        self.asks = set()
+        self.order_side = {}  # live order id -> 1 for bids, -1 for asks
         self.ask_id = self.ask_price = self.bid_id = self.bid_price = self.position = self.position_cost = 0
         self.time = self.bid_qtime = self.ask_qtime = self.bid_etime = self.ask_etime = time.time()
         self.last_trade = self.hedge_price = 0
@@ -103,9 +149,12 @@ class AutoTrader(BaseAutoTrader):
         self.EBid = self.EAsk = self.FBid = self.FAsk = 0
         self.BA_F = self.BA_E = 0
         self.mid_F = self.mid_E = 0
-        self.wpr_E = []  # volume weighted price ETF
-        self.wpr_F = []  # Volume Weighted Price Fut
-        self.vol_E = self.vol_F = self.N_E = self.N_F = self.signal = 0
+        self.stats_E = RollingVolatility()  # ETF weighted price window and volatility
+        self.stats_F = RollingVolatility()  # Future weighted price window and volatility
+        self.signal = 0
+        # Order state handlers indexed by (bid_id != 0) | (ask_id != 0) << 1
+        self._state_handlers = (self._quote_no_orders, self._quote_bid_only, self._quote_ask_only,
+                                self._quote_both_orders)
         self.bid_ask_spreads = []
         self.diff_spread = []
         self.history = []
@@ -119,7 +168,7 @@ class AutoTrader(BaseAutoTrader):
         will identify that order, otherwise the client_order_id will be zero.
         """
         self.logger.warning("error with order %d: %s", client_order_id, error_message.decode())
-        if client_order_id != 0 and (client_order_id in self.bids or client_order_id in self.asks):
+        if client_order_id in self.order_side:
             self.on_order_status_message(client_order_id, 0, 0, 0)
 
     def on_hedge_filled_message(self, client_order_id: int, price: int, volume: int) -> None:
@@ -141,19 +190,14 @@ class AutoTrader(BaseAutoTrader):
         prices are reported along with the volume available at each of those
         price levels.
         """
-        self.logger.info("received order book for instrument %d with sequence number %d", instrument,
-                         sequence_number)
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("received order book for instrument %d with sequence number %d", instrument,
+                             sequence_number)
         # self.orderbook.append([instrument,sequence_number,ask_prices,ask_volumes,bid_prices,bid_volumes])
         # Futures Market
         if instrument == Instrument.FUTURE:
             # Calculate Weighted Price
-            wp = weighted_mid(bid_volumes, bid_prices, ask_volumes, ask_prices)
-            V_bid = 0
-            V_ask = 0
-            for i in range(min(len(bid_volumes), len(ask_volumes))):
-                V_bid += math.exp(-0.5*i) * bid_volumes[i]
-                V_ask += math.exp(-0.5*i) * ask_volumes[i]
-            self.imbal = (V_bid - V_ask) / (V_bid + V_ask) if (V_bid + V_ask) != 0 else 0
+            wp, self.imbal = weighted_mid(bid_volumes, bid_prices, ask_volumes, ask_prices)
             self.FBid = bid_prices[0]
             self.FAsk = ask_prices[0]
             self.mid_F = (self.FBid + self.FAsk)/2
@@ -163,185 +207,128 @@ class AutoTrader(BaseAutoTrader):
                 if wp != 0:
                     self.signal = 1
             if self.signal == 1:
-                self.N_F += 1
-                ts_append(wp, self.wpr_F)
-                # Calculate Volatility
-                if self.N_F > ROLLING_WNDW:
-                    self.wpr_F.pop(0)
-                    self.vol_F = np.std(self.wpr_F)
+                self.stats_F.update(wp)
             
         if instrument == Instrument.ETF:
-            # Calculate Weighted Price
-            wp = weighted_mid(bid_volumes, bid_prices, ask_volumes, ask_prices)
-            self.EBid = bid_prices[0]
-            self.EAsk = ask_prices[0]
-            self.mid_E = (self.EBid + self.EAsk)/2
-            self.BA_E = self.EAsk - self.EBid
-            self.theo_E = wp
-            if self.signal == 0:
-                if wp != 0:
-                    self.signal = 1
-            if self.signal == 1:
-                self.N_E += 1
-                ts_append(wp, self.wpr_E)
-                # Calculate Volatility
-                if self.N_E > ROLLING_WNDW:
-                    self.wpr_E.pop(0)
-                    self.vol_F = np.std(self.wpr_E)
-        
+            self._update_etf_stats(ask_prices, ask_volumes, bid_prices, bid_volumes)
+            # Nothing to quote against until the future book has produced a theo
             if self.theo_F != 0:
-                # Spread Calculation
-                if self.vol_E < VOL1:
-                    K1 = 4
-                    K2 = 4
-                elif self.vol_E < VOL2:
-                    K1 = 6
-                    K2 = 6
-                else:
-                    K1 = 8
-                    K2 = 8
-                if self.imbal > IMBAL_THRESHOLD:
-                    new_ask_price = roundup(self.theo_F + K2 * TICK_SIZE_IN_CENTS)
-                    new_bid_price = rounddown(self.theo_F - K1/2 * TICK_SIZE_IN_CENTS)
-                    tt = "Bid Imbal"
-                elif self.imbal < -IMBAL_THRESHOLD:
-                    new_ask_price = roundup(self.theo_F + K1/2 * TICK_SIZE_IN_CENTS)
-                    new_bid_price = rounddown(self.theo_F - K2 * TICK_SIZE_IN_CENTS)
-                    tt = "Ask Imbal"
-                else:
-                    new_ask_price = roundup(self.theo_F + K1/2 * TICK_SIZE_IN_CENTS)
-                    new_bid_price = rounddown(self.theo_F - K1/2 * TICK_SIZE_IN_CENTS)
-                    tt = "Normal"
-                if self.position >= 0:
-                    new_bid_volume = round(LOT_SIZE * math.exp(INV_SCALAR * self.position))
-                    new_ask_volume = round(LOT_SIZE)
-                if self.position < 0:
-                    new_ask_volume = round(LOT_SIZE * math.exp(-INV_SCALAR * self.position))
-                    new_bid_volume = round(LOT_SIZE)
-                # Orders
-                # If no orders in book
-                if self.bid_id == 0 and self.ask_id == 0:
-                    # Check if new_price is not same as current price
-                    if new_bid_price not in (self.bid_price, 0):
-                        # Send orders
-                        self.bid_id = next(self.order_ids)
-                        self.bid_price = new_bid_price
-                        self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-                        self.logger.info("Order %d: Bid %d @ %d, Imbal: %.2f, Theo: %d, Type: " + tt, self.bid_id, new_bid_volume, new_bid_price, self.imbal, self.theo_F)
-                        self.bids.add(self.bid_id)
-                        self.bid_qtime = time.time()
-                        self.bid_volume = new_bid_volume
-                        self.trade_type = tt
-                        
-                    if new_ask_price not in (self.ask_price, 0):
-                        self.ask_id = next(self.order_ids)
-                        self.ask_price = new_ask_price
-                        self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-                        self.logger.info("Order %d: Ask %d @ %d, Imbal: %.2f, Theo: %d, Type: " + tt, self.ask_id, new_ask_volume, new_ask_price, self.imbal, self.theo_F)
-                        self.asks.add(self.ask_id)
-                        self.ask_qtime = time.time()
-                        self.ask_volume = new_ask_volume
-                        self.trade_type = tt
-                
-                # Else if only 1 order
-                elif self.bid_id == 0 and self.ask_id != 0:
-                    # If didn't wait long enough:
-                    if (time.time() - self.bid_etime) > WAIT_TIME:
-                        self.send_cancel_order(self.ask_id)
-                        self.logger.info("Ask %d Canceled TradeType: " + self.trade_type, self.ask_id)
-                        self.ask_id = 0
-                        # Check if new_price is not same as current price and position limit
-                        if new_bid_price not in (self.bid_price, 0):
-                            # Send orders
-                            self.bid_id = next(self.order_ids)
-                            self.bid_price = new_bid_price
-                            self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Bid %d @ %d, Imbal: %.2f, Theo: %d, Type: " + tt, self.bid_id, new_bid_volume, new_bid_price, self.imbal, self.theo_F)
-                            self.bids.add(self.bid_id)
-                            self.bid_qtime = time.time()
-                            self.bid_volume = new_bid_volume
-                            self.trade_type = tt
-                            
-                        if new_ask_price not in (self.ask_price, 0):
-                            self.ask_id = next(self.order_ids)
-                            self.ask_price = new_ask_price
-                            self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Ask %d @ %d, Imbal: %.2f, Theo: %d, Type: " + tt, self.ask_id, new_ask_volume, new_ask_price, self.imbal, self.theo_F)
-                            self.asks.add(self.ask_id)
-                            self.ask_qtime = time.time()
-                            self.ask_volume = new_ask_volume
-                            self.trade_type = tt
-                    # Else
-                    else:
-                        pass
-                    
-                elif self.bid_id != 0 and self.ask_id == 0:
-                    # If didn't wait long enough:
-                    if (time.time() - self.ask_etime) > WAIT_TIME:
-                        self.send_cancel_order(self.bid_id)
-                        self.logger.info("Bid %d Canceled TradeType: " + self.trade_type, self.bid_id)
-                        self.bid_id = 0
-                        # Check if new_price is not same as current price and position limit
-                        if new_bid_price not in (self.bid_price, 0):
-                            # Send orders
-                            self.bid_id = next(self.order_ids)
-                            self.bid_price = new_bid_price
-                            self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Bid %d @ %d, Imbal: %.2f, Theo: %d, Type: " + tt, self.bid_id, new_bid_volume, new_bid_price, self.imbal, self.theo_F)
-                            self.bids.add(self.bid_id)
-                            self.bid_qtime = time.time()
-                            self.bid_volume = new_bid_volume
-                            self.trade_type = tt
-                            
-                        if new_ask_price not in (self.ask_price, 0):
-                            self.ask_id = next(self.order_ids)
-                            self.ask_price = new_ask_price
-                            self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Ask %d @ %d, Imbal: %.2f, Theo: %d, Type: " + tt, self.ask_id, new_ask_volume, new_ask_price, self.imbal, self.theo_F)
-                            self.asks.add(self.ask_id)
-                            self.ask_qtime = time.time()
-                            self.ask_volume = new_ask_volume
-                            self.trade_type = tt
-                    # Else pass
-                    else:
-                        pass
-                    
-                # If there are 2 orders
-                elif self.bid_id != 0 and self.ask_id != 0:
-                    # If over update threshold
-                    if (time.time() - min(self.ask_qtime, self.bid_qtime)) > UPDATE_TIME:
-                        # Cancel all orders
-                        self.send_cancel_order(self.bid_id)
-                        self.send_cancel_order(self.ask_id)
-                        self.logger.info("Both %d, %d Canceled TradeType: " + self.trade_type, self.bid_id, self.ask_id)
-                        self.bid_id = 0
-                        self.ask_id = 0
-                        # Check if new_price is not same as current price and position limit
-                        if new_bid_price not in (self.bid_price, 0):
-                            # Send orders
-                            self.bid_id = next(self.order_ids)
-                            self.bid_price = new_bid_price
-                            self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, new_bid_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Bid %d @ %d, Imbal: %.2f, Theo: %d, Type: " + tt, self.bid_id, new_bid_volume, new_bid_price, self.imbal, self.theo_F)
-                            self.bids.add(self.bid_id)
-                            self.bid_qtime = time.time()
-                            self.bid_volume = new_bid_volume
-                            self.trade_type = tt
-                            
-                        if new_ask_price not in (self.ask_price, 0):
-                            self.ask_id = next(self.order_ids)
-                            self.ask_price = new_ask_price
-                            self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, new_ask_volume, Lifespan.GOOD_FOR_DAY)
-                            self.logger.info("Order %d: Ask %d @ %d, Imbal: %.2f, Theo: %d, Type: " + tt, self.ask_id, new_ask_volume, new_ask_price, self.imbal, self.theo_F)
-                            self.asks.add(self.ask_id)
-                            self.ask_qtime = time.time()
-                            self.ask_volume = new_ask_volume
-                            self.trade_type = tt
-                    else:
-                        pass
-                        
-
-                    
+                self._maybe_trade_etf()
+
+    def _update_etf_stats(self, ask_prices: List[int], ask_volumes: List[int], bid_prices: List[int],
+                          bid_volumes: List[int]) -> None:
+        """Update the ETF weighted price and its rolling volatility."""
+        # Calculate Weighted Price
+        wp, _ = weighted_mid(bid_volumes, bid_prices, ask_volumes, ask_prices)
+        self.EBid = bid_prices[0]
+        self.EAsk = ask_prices[0]
+        self.mid_E = (self.EBid + self.EAsk)/2
+        self.BA_E = self.EAsk - self.EBid
+        self.theo_E = wp
+        if self.signal == 0:
+            if wp != 0:
+                self.signal = 1
+        if self.signal == 1:
+            self.stats_E.update(wp)
+
+    def _maybe_trade_etf(self) -> None:
+        """Requote the ETF around the future theo when the live orders are due for replacement."""
+        now = time.time()
+        # Spread Calculation
+        vol_E = self.stats_E.vol
+        imbal = self.imbal
+        ask_off, bid_off, tt = _QUOTE_OFFSETS[0 if vol_E < VOL1 else 1 if vol_E < VOL2 else 2][
+            0 if imbal < -IMBAL_THRESHOLD else 2 if imbal > IMBAL_THRESHOLD else 1]
+        # Round the ask up and the bid down to whole ticks
+        theo = self.theo_F
+        new_ask_price = -int((-theo - ask_off) // TICK_SIZE_IN_CENTS) * TICK_SIZE_IN_CENTS
+        new_bid_price = int((theo - bid_off) // TICK_SIZE_IN_CENTS) * TICK_SIZE_IN_CENTS
+        position = self.position
+        if position >= 0:
+            new_bid_volume = _VOL_BY_POS[min(position, POSITION_LIMIT)]
+            new_ask_volume = LOT_SIZE
+        else:
+            new_ask_volume = _VOL_BY_POS[min(-position, POSITION_LIMIT)]
+            new_bid_volume = LOT_SIZE
+        # Orders
+        state = (self.bid_id != 0) | ((self.ask_id != 0) << 1)
+        self._state_handlers[state](now, new_bid_price, new_ask_price, new_bid_volume, new_ask_volume, tt)
+
+    def _quote_no_orders(self, now: float, new_bid_price: int, new_ask_price: int, new_bid_volume: int,
+                         new_ask_volume: int, tt: str) -> None:
+        """Place new quotes when there are no orders in the book."""
+        self._place_bid(new_bid_price, new_bid_volume, tt, now)
+        self._place_ask(new_ask_price, new_ask_volume, tt, now)
+
+    def _quote_ask_only(self, now: float, new_bid_price: int, new_ask_price: int, new_bid_volume: int,
+                        new_ask_volume: int, tt: str) -> None:
+        """Requote once the bid has been gone for long enough, leaving only the ask."""
+        # If didn't wait long enough:
+        if (now - self.bid_etime) > WAIT_TIME:
+            ask_id = self.ask_id
+            self.send_cancel_order(ask_id)
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Ask %d Canceled TradeType: %s", ask_id, self.trade_type)
+            self.ask_id = 0
+            self._place_bid(new_bid_price, new_bid_volume, tt, now)
+            self._place_ask(new_ask_price, new_ask_volume, tt, now)
+
+    def _quote_bid_only(self, now: float, new_bid_price: int, new_ask_price: int, new_bid_volume: int,
+                        new_ask_volume: int, tt: str) -> None:
+        """Requote once the ask has been gone for long enough, leaving only the bid."""
+        # If didn't wait long enough:
+        if (now - self.ask_etime) > WAIT_TIME:
+            bid_id = self.bid_id
+            self.send_cancel_order(bid_id)
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Bid %d Canceled TradeType: %s", bid_id, self.trade_type)
+            self.bid_id = 0
+            self._place_bid(new_bid_price, new_bid_volume, tt, now)
+            self._place_ask(new_ask_price, new_ask_volume, tt, now)
+
+    def _quote_both_orders(self, now: float, new_bid_price: int, new_ask_price: int, new_bid_volume: int,
+                           new_ask_volume: int, tt: str) -> None:
+        """Replace both orders once they are older than the update threshold."""
+        # If over update threshold
+        if (now - min(self.ask_qtime, self.bid_qtime)) > UPDATE_TIME:
+            # Cancel all orders
+            bid_id = self.bid_id
+            ask_id = self.ask_id
+            self.send_cancel_order(bid_id)
+            self.send_cancel_order(ask_id)
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Both %d, %d Canceled TradeType: %s", bid_id, ask_id, self.trade_type)
+            self.bid_id = 0
+            self.ask_id = 0
+            self._place_bid(new_bid_price, new_bid_volume, tt, now)
+            self._place_ask(new_ask_price, new_ask_volume, tt, now)
+
+    def _place_bid(self, price: int, volume: int, tt: str, now: float) -> None:
+        """Insert a new bid unless it would be at zero or the current bid price."""
+        if price not in (self.bid_price, 0):
+            self.bid_id = next(self.order_ids)
+            self.bid_price = price
+            self.send_insert_order(self.bid_id, Side.BUY, price, volume, Lifespan.GOOD_FOR_DAY)
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info(_FMT_BID[tt], self.bid_id, volume, price, self.imbal, self.theo_F)
+            self.order_side[self.bid_id] = 1
+            self.bid_qtime = now
+            self.bid_volume = volume
+            self.trade_type = tt
+
+    def _place_ask(self, price: int, volume: int, tt: str, now: float) -> None:
+        """Insert a new ask unless it would be at zero or the current ask price."""
+        if price not in (self.ask_price, 0):
+            self.ask_id = next(self.order_ids)
+            self.ask_price = price
+            self.send_insert_order(self.ask_id, Side.SELL, price, volume, Lifespan.GOOD_FOR_DAY)
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info(_FMT_ASK[tt], self.ask_id, volume, price, self.imbal, self.theo_F)
+            self.order_side[self.ask_id] = -1
+            self.ask_qtime = now
+            self.ask_volume = volume
+            self.trade_type = tt
+
     def on_order_filled_message(self, client_order_id: int, price: int, volume: int) -> None:
         """Called when one of your orders is filled, partially or fully.
 
@@ -349,13 +336,14 @@ class AutoTrader(BaseAutoTrader):
         which may be better than the order's limit price. The volume is
         the number of lots filled at that price.
         """
-        self.logger.info("received order filled for order %d with price %d and volume %d TradeType: " + self.trade_type, client_order_id,
-                         price, volume)
+        self.logger.info("received order filled for order %d with price %d and volume %d TradeType: %s", client_order_id,
+                         price, volume, self.trade_type)
         # Hedge
-        if client_order_id in self.bids:
+        side = self.order_side.get(client_order_id)
+        if side == 1:
             self.position += volume
             self.send_hedge_order(next(self.order_ids), Side.ASK, MIN_BID_NEAREST_TICK, volume)
-        elif client_order_id in self.asks:
+        elif side == -1:
             self.position -= volume
             self.send_hedge_order(next(self.order_ids), Side.BID, MAX_ASK_NEAREST_TICK, volume)
             
@@ -377,15 +365,14 @@ class AutoTrader(BaseAutoTrader):
             if client_order_id == self.bid_id:
                 self.bid_id = 0
                 self.bid_etime = time.time()
-                self.logger.info("Bid Execution Time: %.4f TradeType: " + self.trade_type, self.bid_etime - self.bid_qtime)
+                self.logger.info("Bid Execution Time: %.4f TradeType: %s", self.bid_etime - self.bid_qtime, self.trade_type)
             
             elif client_order_id == self.ask_id:
                 self.ask_id = 0
                 self.ask_etime = time.time()
-                self.logger.info("Ask Execution Time: %.4f TradeType: " + self.trade_type, self.ask_etime - self.ask_qtime)
+                self.logger.info("Ask Execution Time: %.4f TradeType: %s", self.ask_etime - self.ask_qtime, self.trade_type)
             # It could be either a bid or an ask
-            self.bids.discard(client_order_id)
-            self.asks.discard(client_order_id)
+            self.order_side.pop(client_order_id, None)
             
     def on_trade_ticks_message(self, instrument: int, sequence_number: int, ask_prices: List[int],
                                ask_volumes: List[int], bid_prices: List[int], bid_volumes: List[int]) -> None: